@@ -4,6 +4,7 @@ import threading
 import time
 import json
 import queue
+import re
 import traceback
 import pyaudio
 import numpy as np
@@ -33,11 +34,23 @@ except ImportError:
 
 try:
     from flask import Flask, request, jsonify
-    from flask_socketio import SocketIO, emit
+    from flask_socketio import SocketIO, emit, join_room, leave_room
 except ImportError:
     print("ERROR: Flask or Flask-SocketIO not found. Please install them: pip install Flask Flask-SocketIO")
     sys.exit(1)
 
+from extraction import (
+    EXTRACTION_MODES,
+    build_extraction_prompt,
+    cap_description,
+    merge_description,
+    new_extraction_stats,
+    output_format,
+    parse_extraction_output,
+    record_extraction_call,
+    summarize_extraction_stats,
+)
+
 
 # --- Configuration ---
 # Audio settings
@@ -51,9 +64,20 @@ AUDIO_OVERLAP_DURATION = 3    # seconds: Maintain overlap for smoother transcrip
 # AI Model settings
 WHISPER_MODEL = "small.en"    # Choose based on performance/accuracy: "tiny.en", "base.en", "small.en", "medium.en"
 OLLAMA_MODEL = "phi4-mini:latest" # Or "phi4:latest". Phi-3 is generally better.
+EXTRACTION_OUTPUT_MODE = "terse"  # Default per session: "terse" (type codes, delta-only descriptions) or "verbose" (full JSON objects)
+EXTRACTION_USE_SCHEMA = True      # Default per session: constrain extraction output with a JSON schema via Ollama's `format`
+# Set e.g. EXTRACTION_RECORD_FILE=extraction_calls.jsonl in the environment to append every raw
+# extraction response to that file for extraction_replay.py
+EXTRACTION_RECORD_FILE = os.environ.get("EXTRACTION_RECORD_FILE") or None
+
+# Multi-session settings
+DEFAULT_SESSION_ID = "default"      # Session used when a client doesn't specify one (the single-stream UI)
+WHISPER_POOL_SIZE = 1               # Whisper model replicas shared by ALL sessions (each one costs the full model memory)
+OLLAMA_MAX_CONCURRENT_REQUESTS = 1  # Ollama calls allowed in flight at once across ALL sessions
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$') # Session IDs are used in room and file names
 
 # Session persistence
-SESSION_DATA_FILE = "session_data.json"
+SESSION_DATA_FILE = "session_data.json" # Default session; other sessions use "session_data_<session_id>.json"
 
 # --- Global Application State ---
 app = Flask(__name__)
@@ -61,20 +85,13 @@ app = Flask(__name__)
 # cors_allowed_origins="*" is for development. Restrict to specific origins in production.
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
-# Flags and Queues for managing audio processing threads
-is_listening = False
-audio_queue = queue.Queue()       # Stores raw audio data chunks
-transcript_queue = queue.Queue()  # Stores transcribed text chunks
-
-# Rolling buffer to provide more context to the LLM
-llm_context_buffer = []
+# Rolling buffer to provide more context to the LLM (kept per session)
 MAX_LLM_CONTEXT_LENGTH = 1500 # Max characters in the rolling context for LLM (adjust based on model context window)
 # This is a rough estimate; Phi-3 has a 4K or 8K context window usually, so 1500 chars is safe.
+MAX_LLM_HISTORY_MESSAGES = 10 # Q&A messages kept per session (plus the system message)
 
-# Global chat history for conversational memory
-llm_chat_history = []
+# Each session's chat history for conversational memory starts with this system message.
 # This will be used for both entity extraction and Q&A
-# Start with a base system message
 BASE_SYSTEM_MESSAGE = """
 
 IGNORE_WHEN_COPYING_START
@@ -95,17 +112,6 @@ Example JSON for a Character: {"type": "Character", "name": "John Doe", "descrip
 Example JSON for a Location: {"type": "Location", "name": "Camelot", "description": "King Arthur's legendary castle."}
 """
 
-# Initialize the LLM's full conversational history
-llm_messages_history = [
-    {"role": "system", "content": BASE_SYSTEM_MESSAGE}
-]
-
-current_video_title = "Unknown Video" # Global to store detected title
-
-# Data structure to hold our live cheat sheet entities
-# Stored as {entity_name: {type, name, description}} for easy lookup and update
-cheat_sheet_data = {}
-
 # --- Helper Function: Find Audio Input Device ---
 def find_system_audio_input_device():
     """
@@ -175,448 +181,854 @@ def get_active_browser_tab_title():
         return title # Return full title if no specific pattern found
     return "Unknown Video (no active window)"
 
-# --- Audio Recording Thread ---
-def audio_recorder():
+
+# --- Shared Model Resources ---
+# Loaded once per process and shared by every session, so several streams can be
+# followed at the same time without each one paying the multi-GB model memory.
+class WhisperModelPool:
     """
-    Captures audio from the selected input device, processes it into chunks,
-    and puts chunks into the audio_queue for transcription.
+    Lazily loads WHISPER_POOL_SIZE copies of the Whisper model and lends them out
+    to the sessions' transcription threads. A Whisper model must not be used from
+    two threads at once, so each transcribe() call holds one replica exclusively.
     """
-    print("DEBUG: Inside audio_recorder thread.")
-    global audio_stream, is_listening
-    p = None # Initialize PyAudio instance to None
+    def __init__(self, model_name, size):
+        self.model_name = model_name
+        self.size = max(1, size)
+        self._models = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def ensure_loaded(self):
+        """
+        Loads the model replicas on first use. Raises if loading fails,
+        in which case a later call will try again.
+        """
+        with self._load_lock:
+            if self._loaded:
+                return
+            models = [whisper.load_model(self.model_name) for _ in range(self.size)]
+            for model in models:
+                self._models.put(model)
+            self._loaded = True
+            print(f"DEBUG: Whisper model '{self.model_name}' loaded ({self.size} shared replica(s)).")
+
+    def transcribe(self, audio_np, **kwargs):
+        """
+        Transcribes audio with the next free model replica, blocking until one is available.
+        """
+        self.ensure_loaded()
+        model = self._models.get()
+        try:
+            return model.transcribe(audio_np, **kwargs)
+        finally:
+            self._models.put(model)
 
-    try:
-        p = pyaudio.PyAudio() # Initialize PyAudio inside the try block
-        device_id = find_system_audio_input_device()
-
-        if device_id == -1:
-            socketio.emit('status', {'message': 'Error: Audio input device not found. Please check setup.'})
-            print("ERROR: Audio input device not found. Stopping audio_recorder thread.")
-            is_listening = False
-            return # Exit thread if device not found
-
-        print(f"DEBUG: Using audio device ID: {device_id}")
-        print(f"DEBUG: Device name: {p.get_device_info_by_host_api_device_index(0, device_id).get('name')}")
-
-        # Open the audio stream
-        audio_stream = p.open(format=AUDIO_FORMAT,
-                              channels=AUDIO_CHANNELS,
-                              rate=AUDIO_RATE,
-                              input=True,
-                              frames_per_buffer=AUDIO_CHUNK_SIZE,
-                              input_device_index=device_id)
-        
-        socketio.emit('status', {'message': 'Listening to audio...'})
-        print("Audio stream started.")
-
-        # Calculate buffer parameters for Whisper chunks
-        frames_per_full_buffer = int(AUDIO_RATE * AUDIO_BUFFER_DURATION)
-        frames_per_overlap = int(AUDIO_RATE * AUDIO_OVERLAP_DURATION)
-        
-        # Buffer to accumulate audio before sending to Whisper
-        audio_buffer = np.empty(0, dtype=np.int16) 
-
-        while is_listening:
-            try:
-                # Read audio data
-                data = audio_stream.read(AUDIO_CHUNK_SIZE, exception_on_overflow=False)
-                audio_np = np.frombuffer(data, dtype=np.int16)
-                audio_buffer = np.append(audio_buffer, audio_np)
-                
-                # If buffer is full, send to queue and maintain overlap
-                if len(audio_buffer) >= frames_per_full_buffer:
-                    full_audio_data = audio_buffer[:frames_per_full_buffer]
-                    audio_queue.put(full_audio_data.tobytes()) # Convert numpy array back to bytes for queue
-                    
-                    # Keep overlap for next buffer
-                    audio_buffer = audio_buffer[frames_per_full_buffer - frames_per_overlap:]
-
-            except IOError as e:
-                # Catch specific audio stream errors (e.g., device unplugged)
-                print(f"ERROR: Audio stream IOError: {e}")
-                socketio.emit('status', {'message': f'Audio error: {e}. Stopping listening.'})
-                is_listening = False # Stop the main loop
-                break # Exit the while loop
-            except Exception as e:
-                print(f"CRITICAL ERROR in audio_recorder loop: {e}")
-                traceback.print_exc()
-                socketio.emit('status', {'message': f'CRITICAL AUDIO ERROR: {e}. Stopping listening.'})
-                is_listening = False
-                break
-            time.sleep(0.01) # Small delay to prevent busy-waiting
 
-    except Exception as e:
-        print(f"CRITICAL ERROR starting audio_recorder: {e}")
-        traceback.print_exc()
-        socketio.emit('status', {'message': f'Error starting audio stream: {e}'})
-        is_listening = False # Ensure listening flag is set to False on critical failure
-    finally:
-        # Cleanup audio resources
-        if audio_stream and audio_stream.is_active():
-            audio_stream.stop_stream()
-            audio_stream.close()
-            print("Audio stream stopped.")
-        if p: # Ensure PyAudio instance was successfully created before terminating
-            p.terminate()
-            print("PyAudio terminated.")
-        
-        socketio.emit('status', {'message': 'Audio capture stopped.'})
-        print("Audio recording thread finished.")
-
-
-# --- Whisper Transcription Thread ---
-def transcribe_audio():
-    """
-    Pulls audio data from audio_queue, transcribes it using Whisper,
-    and puts the text into transcript_queue.
-    """
-    print("DEBUG: Inside transcribe_audio thread.")
-    global is_listening
-    
-    try:
-        model = whisper.load_model(WHISPER_MODEL)
-        print(f"DEBUG: Whisper model '{WHISPER_MODEL}' loaded.")
-        socketio.emit('status', {'message': f'Whisper model loaded: {WHISPER_MODEL}'})
-    except Exception as e:
-        print(f"ERROR: Failed to load Whisper model: {e}. Ensure models are downloaded and torch/CUDA is configured.")
-        traceback.print_exc()
-        socketio.emit('status', {'message': f'Error loading Whisper model: {e}'})
-        is_listening = False # Critical failure, stop all processing
-        return
+class OllamaScheduler:
+    """
+    Funnels Ollama calls from every session through a shared semaphore so that
+    concurrent streams queue for the local model instead of overloading it.
+    """
+    def __init__(self, max_concurrent):
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent))
 
-    while is_listening or not audio_queue.empty():
-        if not audio_queue.empty():
-            audio_data_bytes = audio_queue.get()
-            audio_np = np.frombuffer(audio_data_bytes, dtype=np.int16).flatten().astype(np.float32) / 32768.0
-            
-            try:
-                # Transcribe the audio chunk
-                result = model.transcribe(audio_np, fp16=False) # fp16=False if no compatible GPU
-                transcript = result["text"].strip()
-                
-                if transcript: # Only process non-empty transcripts
-                    print(f"DEBUG: Transcribed: {transcript}")
-                    transcript_queue.put(transcript)
-                    # Emit live transcript to Electron UI
-                    socketio.emit('new_transcript', {'text': transcript})
-            except Exception as e:
-                print(f"ERROR: Error during Whisper transcription: {e}")
-                traceback.print_exc()
-        else:
-            time.sleep(0.1) # Wait if audio_queue is empty
-
-    print("Transcription thread stopped.")
-
-
-# --- Ollama LLM Processing Thread ---
-def process_transcript_with_ollama():
-    """
-    Pulls transcribed text from transcript_queue, sends it to Ollama,
-    parses the response, and updates/emits cheat sheet data.
-    """
-    print("DEBUG: Inside process_transcript_with_ollama thread.")
-    global cheat_sheet_data, is_listening, llm_context_buffer, current_video_title
-
-    # New variables for buffering LLM calls
-    llm_processing_buffer_text = ""
-    MIN_CHARS_FOR_LLM_CALL = 500  # Adjust this threshold
-    LAST_LLM_CALL_TIME = time.time()
-    LLM_CALL_INTERVAL_SECONDS = 15  # Call at least every X seconds, even if buffer is small
-
-    while is_listening or not transcript_queue.empty():
-        if not transcript_queue.empty():
-            latest_transcript = transcript_queue.get()
-
-            # --- Update Rolling Context Buffer ---
-            llm_context_buffer.append(latest_transcript)
-            
-            # Keep buffer within MAX_LLM_CONTEXT_LENGTH
-            current_context_text = " ".join(llm_context_buffer)
-            while len(current_context_text) > MAX_LLM_CONTEXT_LENGTH and len(llm_context_buffer) > 1:
-                llm_context_buffer.pop(0)  # Remove oldest chunk
-                current_context_text = " ".join(llm_context_buffer)
-            
-            print(f"DEBUG: Current LLM context buffer length: {len(current_context_text)} chars.")
-            
-            # --- Dynamic Title Acquisition ---
-            # Update title periodically, not on every single LLM call for performance
-            if len(llm_context_buffer) % 5 == 0:  # Check title every 5 transcript chunks
-                detected_title = get_active_browser_tab_title()
-                if detected_title != current_video_title and "Unknown Video" not in detected_title:
-                    current_video_title = detected_title
-                    print(f"DEBUG: Detected new video title: '{current_video_title}'")
-                    socketio.emit('status', {'message': f'Analyzing: "{current_video_title}"'})
-                elif "Unknown Video" in detected_title and current_video_title == "Unknown Video":
-                    print(f"DEBUG: Still unable to detect specific video title. Current: {current_video_title}")
-
-            # Add to the processing buffer for the LLM call itself
-            llm_processing_buffer_text += " " + latest_transcript
-
-            # Decide when to call LLM
-            current_time = time.time()
-            if len(llm_processing_buffer_text) >= MIN_CHARS_FOR_LLM_CALL or \
-               (current_time - LAST_LLM_CALL_TIME >= LLM_CALL_INTERVAL_SECONDS and len(llm_processing_buffer_text) > 0):
-                
-                print(f"DEBUG: Triggering LLM call. Buffer chars: {len(llm_processing_buffer_text)}")
-                
-                # --- Prepare prompt with current context ---
-                current_cheat_sheet_json = json.dumps(list(cheat_sheet_data.values()), indent=2)
-                
-                # Use both the processing buffer and rolling context in the prompt
-                prompt = f"""
-You are an AI assistant specialized in extracting named entities from video transcripts to create a structured cheat sheet.
-Your primary goal is to help a user follow the narrative or informational content of a video.
-The current video title is: "{current_video_title}".
+    def chat(self, **kwargs):
+        with self._slots:
+            return ollama.chat(**kwargs)
 
-Text to analyze for new entities:
-{llm_processing_buffer_text}
 
-Broader historical context:
-{current_context_text}
+whisper_pool = WhisperModelPool(WHISPER_MODEL, WHISPER_POOL_SIZE)
+ollama_scheduler = OllamaScheduler(OLLAMA_MAX_CONCURRENT_REQUESTS)
 
-Based on this title and the content, identify entities that are relevant to the narrative/story/topic of this specific video. Focus on:
 
-    Characters: Individuals, sentient beings, their roles, and key relationships.
+# --- Session Helpers ---
+def is_valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
 
-    Locations: Specific places (cities, buildings, fictional realms), their significance.
+def session_room(session_id):
+    """
+    Socket.IO room that receives a session's events.
+    """
+    return f"session:{session_id}"
 
-    Organizations: Groups, factions, institutions relevant to the plot/topic.
+def session_data_file(session_id):
+    """
+    Persistence file for a session. The default session keeps the original file name.
+    """
+    if session_id == DEFAULT_SESSION_ID:
+        return SESSION_DATA_FILE
+    return f"session_data_{session_id}.json"
 
-    Key Objects/Items: Important artifacts, tools, or unique items that drive the story/topic.
 
-    Concepts/Events: Important ideas, theories, historical events, or major plot points.
-    For 'Event' entities, include an optional 'date' key with a relevant date/timeframe if explicitly mentioned.
+# --- Per-Session Pipeline ---
+class StreamSession:
+    """
+    The processing pipeline for one followed video stream.
+    Owns its audio/transcript queues, rolling LLM context, Q&A history and cheat sheet
+    entities, and runs its own capture, transcription and LLM threads. The Whisper
+    model and Ollama access are shared with all other sessions.
+    """
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.room = session_room(session_id)
+        self.data_file = session_data_file(session_id)
+
+        # Flags and Queues for managing audio processing threads
+        self.is_listening = False
+        self.audio_queue = queue.Queue()       # Stores raw audio data chunks
+        self.transcript_queue = queue.Queue()  # Stores transcribed text chunks
+        self.input_device_index = None         # None = auto-detect the system audio device
+
+        # Rolling buffer to provide more context to the LLM
+        self.llm_context_buffer = []
+
+        # Full conversational history for Q&A
+        self.llm_messages_history = [
+            {"role": "system", "content": BASE_SYSTEM_MESSAGE}
+        ]
+
+        self.current_video_title = "Unknown Video" # Detected or user-provided title
+        self.title_is_manual = False               # True once set via /set_title; disables auto-detection
+
+        # Data structure to hold our live cheat sheet entities
+        # Stored as {entity_name: {type, name, description}} for easy lookup and update
+        self.cheat_sheet_data = {}
+
+        # Extraction protocol (can be chosen per session on /start) and its decode-token/batch-loss counters
+        self.extraction_mode = EXTRACTION_OUTPUT_MODE
+        self.extraction_use_schema = EXTRACTION_USE_SCHEMA
+        self.extraction_stats = new_extraction_stats(self.extraction_mode, self.extraction_use_schema)
+
+    def emit(self, event, data):
+        """
+        Emits a Socket.IO event to the clients following this session only.
+        """
+        socketio.emit(event, data, to=self.room)
+
+    def auto_detects_title(self):
+        """
+        The foreground browser window belongs to whoever is at the desk, so only the default
+        session follows it, and only until the user sets a title themselves.
+        """
+        return self.session_id == DEFAULT_SESSION_ID and not self.title_is_manual
+
+    def set_title(self, title):
+        self.current_video_title = title
+        self.title_is_manual = True
+
+    def set_extraction_protocol(self, mode, use_schema):
+        """
+        Switches the extraction protocol. Stats restart so they always describe a single protocol.
+        """
+        if (mode, use_schema) != (self.extraction_mode, self.extraction_use_schema):
+            self.extraction_mode = mode
+            self.extraction_use_schema = use_schema
+            self.extraction_stats = new_extraction_stats(mode, use_schema)
+
+    def summary(self):
+        return {
+            "session_id": self.session_id,
+            "is_listening": self.is_listening,
+            "video_title": self.current_video_title,
+            "input_device_index": self.input_device_index,
+            "cheat_sheet_size": len(self.cheat_sheet_data),
+            "extraction_stats": summarize_extraction_stats(self.extraction_stats),
+        }
 
-For each identified entity, provide its 'type' (e.g., "Character", "Location", "Concept"), 'name', and a concise 'description'.
-If an entity has been previously mentioned in the context and new information is provided, update its 'description'.
-Only include entities that are clearly named or explicitly described in the transcript and are relevant to the main content of the video as suggested by its title and ongoing discussion.
+    # --- Audio Recording Thread ---
+    def audio_recorder(self):
+        """
+        Captures audio from the session's input device, processes it into chunks,
+        and puts chunks into the audio_queue for transcription.
+        """
+        print(f"DEBUG: [{self.session_id}] Inside audio_recorder thread.")
+        p = None # Initialize PyAudio instance to None
+        audio_stream = None
 
-Crucially, format your output as a JSON array of objects.
-Each object MUST have the keys 'type', 'name', and 'description'.
-For 'Event' type entities, you MAY include an optional 'date' key if a specific date or timeframe is mentioned.
-Do NOT include any other keys or outer objects like 'entities'. Just the array.
-If no new or updated entities are found that fit the criteria, return an empty array [].
+        try:
+            p = pyaudio.PyAudio() # Initialize PyAudio inside the try block
+            if self.input_device_index is not None:
+                device_id = self.input_device_index
+            else:
+                device_id = find_system_audio_input_device()
 
-Example JSON for a Character: {{"type": "Character", "name": "John Doe", "description": "A brave knight who served King Arthur."}}
-Example JSON for a Location: {{"type": "Location", "name": "Camelot", "description": "King Arthur's legendary castle."}}
-Example JSON for an Event: {{"type": "Event", "name": "Battle of Gettysburg", "description": "Major battle of the American Civil War.", "date": "July 1-3, 1863"}}
+            if device_id == -1:
+                self.emit('status', {'message': 'Error: Audio input device not found. Please check setup.'})
+                print(f"ERROR: [{self.session_id}] Audio input device not found. Stopping audio_recorder thread.")
+                self.is_listening = False
+                return # Exit thread if device not found
 
-Current cheat sheet context (as JSON array):
-{current_cheat_sheet_json}
+            print(f"DEBUG: [{self.session_id}] Using audio device ID: {device_id}")
+            print(f"DEBUG: [{self.session_id}] Device name: {p.get_device_info_by_host_api_device_index(0, device_id).get('name')}")
 
-JSON Output:
-"""
-                messages = [
-                    {"role": "user", "content": prompt}
-                ]
+            # Open the audio stream
+            audio_stream = p.open(format=AUDIO_FORMAT,
+                                  channels=AUDIO_CHANNELS,
+                                  rate=AUDIO_RATE,
+                                  input=True,
+                                  frames_per_buffer=AUDIO_CHUNK_SIZE,
+                                  input_device_index=device_id)
+
+            self.emit('status', {'message': 'Listening to audio...'})
+            print(f"[{self.session_id}] Audio stream started.")
 
-                # Emit the prompt BEFORE the Ollama call
-                socketio.emit('llm_communication', {'prompt': prompt})
+            # Calculate buffer parameters for Whisper chunks
+            frames_per_full_buffer = int(AUDIO_RATE * AUDIO_BUFFER_DURATION)
+            frames_per_overlap = int(AUDIO_RATE * AUDIO_OVERLAP_DURATION)
 
+            # Buffer to accumulate audio before sending to Whisper
+            audio_buffer = np.empty(0, dtype=np.int16)
+
+            while self.is_listening:
                 try:
-                    # Make the call to the local Ollama server
-                    response = ollama.chat(model=OLLAMA_MODEL, messages=messages, format='json')
-                    content = response['message']['content']
-
-                    # Emit the raw response AFTER the Ollama call (before parsing)
-                    socketio.emit('llm_communication', {'response': content})
-
-                    try:
-                        extracted_entities = json.loads(content)
-                        
-                        # --- Robustness: Attempt to unwrap if Ollama put it in an 'entities' object ---
-                        if isinstance(extracted_entities, dict) and "entities" in extracted_entities:
-                            print("WARNING: Ollama returned an object with 'entities' key. Attempting to unwrap.")
-                            extracted_entities = extracted_entities["entities"]
-
-                        if isinstance(extracted_entities, list):
-                            print(f"DEBUG: Ollama extracted {len(extracted_entities)} entities from transcript.")
-                            for entity in extracted_entities:
-                                # --- Robustness: Handle different key names from Ollama if it deviates ---
-                                entity_name = entity.get('name') or entity.get('entity') or entity.get('value')
-                                entity_type = entity.get('type')
-                                entity_description = entity.get('description') or ""
-
-                                # Only process if essential keys are present
-                                if entity_name and entity_type:
-                                    processed_entity = {
-                                        'name': entity_name,
-                                        'type': entity_type,
-                                        'description': entity_description
-                                    }
-                                    
-                                    existing_entity = cheat_sheet_data.get(processed_entity['name'])
-                                    if existing_entity:
-                                        # Update description only if new one is more detailed/different
-                                        if len(processed_entity['description']) > len(existing_entity['description']) or processed_entity['description'] != existing_entity['description']:
-                                            cheat_sheet_data[processed_entity['name']]['description'] = processed_entity['description']
-                                            print(f"DEBUG: Updated entity: {processed_entity['name']} ({processed_entity['type']})")
-                                            socketio.emit('update_cheat_sheet', cheat_sheet_data[processed_entity['name']])
-                                    else:
-                                        # Add new entity
-                                        cheat_sheet_data[processed_entity['name']] = processed_entity
-                                        print(f"DEBUG: New entity found: {processed_entity['name']} ({processed_entity['type']})")
-                                        socketio.emit('update_cheat_sheet', cheat_sheet_data[processed_entity['name']])
-                                else:
-                                    print(f"WARNING: Malformed entity from Ollama (missing 'name'/'type'): {entity}")
-                        else:
-                            print(f"WARNING: Ollama did not return a JSON array as expected (after unwrap attempt): {content}")
-
-                    except json.JSONDecodeError as e:
-                        print(f"ERROR: Failed to decode Ollama JSON: {e}")
-                        print(f"ERROR: Content that caused JSON error: {content}")
-                    
+                    # Read audio data
+                    data = audio_stream.read(AUDIO_CHUNK_SIZE, exception_on_overflow=False)
+                    audio_np = np.frombuffer(data, dtype=np.int16)
+                    audio_buffer = np.append(audio_buffer, audio_np)
+
+                    # If buffer is full, send to queue and maintain overlap
+                    if len(audio_buffer) >= frames_per_full_buffer:
+                        full_audio_data = audio_buffer[:frames_per_full_buffer]
+                        self.audio_queue.put(full_audio_data.tobytes()) # Convert numpy array back to bytes for queue
+
+                        # Keep overlap for next buffer
+                        audio_buffer = audio_buffer[frames_per_full_buffer - frames_per_overlap:]
+
+                except IOError as e:
+                    # Catch specific audio stream errors (e.g., device unplugged)
+                    print(f"ERROR: [{self.session_id}] Audio stream IOError: {e}")
+                    self.emit('status', {'message': f'Audio error: {e}. Stopping listening.'})
+                    self.is_listening = False # Stop the main loop
+                    break # Exit the while loop
                 except Exception as e:
-                    print(f"ERROR: Error calling Ollama API or general processing error: {e}")
+                    print(f"CRITICAL ERROR in audio_recorder loop [{self.session_id}]: {e}")
                     traceback.print_exc()
+                    self.emit('status', {'message': f'CRITICAL AUDIO ERROR: {e}. Stopping listening.'})
+                    self.is_listening = False
+                    break
+                time.sleep(0.01) # Small delay to prevent busy-waiting
+
+        except Exception as e:
+            print(f"CRITICAL ERROR starting audio_recorder [{self.session_id}]: {e}")
+            traceback.print_exc()
+            self.emit('status', {'message': f'Error starting audio stream: {e}'})
+            self.is_listening = False # Ensure listening flag is set to False on critical failure
+        finally:
+            # Cleanup audio resources
+            if audio_stream and audio_stream.is_active():
+                audio_stream.stop_stream()
+                audio_stream.close()
+                print(f"[{self.session_id}] Audio stream stopped.")
+            if p: # Ensure PyAudio instance was successfully created before terminating
+                p.terminate()
+                print(f"[{self.session_id}] PyAudio terminated.")
+
+            self.emit('status', {'message': 'Audio capture stopped.'})
+            print(f"[{self.session_id}] Audio recording thread finished.")
+
+    # --- Whisper Transcription Thread ---
+    def transcribe_audio(self):
+        """
+        Pulls audio data from audio_queue, transcribes it with the shared Whisper pool,
+        and puts the text into transcript_queue.
+        """
+        print(f"DEBUG: [{self.session_id}] Inside transcribe_audio thread.")
+
+        try:
+            whisper_pool.ensure_loaded()
+            self.emit('status', {'message': f'Whisper model loaded: {WHISPER_MODEL}'})
+        except Exception as e:
+            print(f"ERROR: Failed to load Whisper model: {e}. Ensure models are downloaded and torch/CUDA is configured.")
+            traceback.print_exc()
+            self.emit('status', {'message': f'Error loading Whisper model: {e}'})
+            self.is_listening = False # Critical failure, stop all processing
+            return
+
+        while self.is_listening or not self.audio_queue.empty():
+            if not self.audio_queue.empty():
+                audio_data_bytes = self.audio_queue.get()
+                audio_np = np.frombuffer(audio_data_bytes, dtype=np.int16).flatten().astype(np.float32) / 32768.0
+
+                try:
+                    # Transcribe the audio chunk
+                    result = whisper_pool.transcribe(audio_np, fp16=False) # fp16=False if no compatible GPU
+                    transcript = result["text"].strip()
+
+                    if transcript: # Only process non-empty transcripts
+                        print(f"DEBUG: [{self.session_id}] Transcribed: {transcript}")
+                        self.transcript_queue.put(transcript)
+                        # Emit live transcript to Electron UI
+                        self.emit('new_transcript', {'text': transcript})
+                except Exception as e:
+                    print(f"ERROR: [{self.session_id}] Error during Whisper transcription: {e}")
+                    traceback.print_exc()
+            else:
+                time.sleep(0.1) # Wait if audio_queue is empty
+
+        print(f"[{self.session_id}] Transcription thread stopped.")
+
+    # --- Ollama LLM Processing Thread ---
+    def process_transcript_with_ollama(self):
+        """
+        Pulls transcribed text from transcript_queue, sends it to Ollama,
+        parses the response, and updates/emits cheat sheet data.
+        """
+        print(f"DEBUG: [{self.session_id}] Inside process_transcript_with_ollama thread.")
+
+        # New variables for buffering LLM calls
+        llm_processing_buffer_text = ""
+        MIN_CHARS_FOR_LLM_CALL = 500  # Adjust this threshold
+        LAST_LLM_CALL_TIME = time.time()
+        LLM_CALL_INTERVAL_SECONDS = 15  # Call at least every X seconds, even if buffer is small
+
+        while self.is_listening or not self.transcript_queue.empty():
+            if not self.transcript_queue.empty():
+                latest_transcript = self.transcript_queue.get()
+
+                # --- Update Rolling Context Buffer ---
+                self.llm_context_buffer.append(latest_transcript)
+
+                # Keep buffer within MAX_LLM_CONTEXT_LENGTH
+                current_context_text = " ".join(self.llm_context_buffer)
+                while len(current_context_text) > MAX_LLM_CONTEXT_LENGTH and len(self.llm_context_buffer) > 1:
+                    self.llm_context_buffer.pop(0)  # Remove oldest chunk
+                    current_context_text = " ".join(self.llm_context_buffer)
+
+                print(f"DEBUG: [{self.session_id}] Current LLM context buffer length: {len(current_context_text)} chars.")
+
+                # --- Dynamic Title Acquisition ---
+                # Update title periodically, not on every single LLM call for performance
+                if self.auto_detects_title() and len(self.llm_context_buffer) % 5 == 0:  # Check title every 5 transcript chunks
+                    detected_title = get_active_browser_tab_title()
+                    if detected_title != self.current_video_title and "Unknown Video" not in detected_title:
+                        self.current_video_title = detected_title
+                        print(f"DEBUG: [{self.session_id}] Detected new video title: '{self.current_video_title}'")
+                        self.emit('status', {'message': f'Analyzing: "{self.current_video_title}"'})
+                    elif "Unknown Video" in detected_title and self.current_video_title == "Unknown Video":
+                        print(f"DEBUG: [{self.session_id}] Still unable to detect specific video title. Current: {self.current_video_title}")
+
+                # Add to the processing buffer for the LLM call itself
+                llm_processing_buffer_text += " " + latest_transcript
+
+                # Decide when to call LLM
+                current_time = time.time()
+                if len(llm_processing_buffer_text) >= MIN_CHARS_FOR_LLM_CALL or \
+                   (current_time - LAST_LLM_CALL_TIME >= LLM_CALL_INTERVAL_SECONDS and len(llm_processing_buffer_text) > 0):
+
+                    print(f"DEBUG: [{self.session_id}] Triggering LLM call. Buffer chars: {len(llm_processing_buffer_text)}")
+
+                    self.run_extraction(llm_processing_buffer_text, current_context_text)
+
+                    # Reset the processing buffer and timer
+                    llm_processing_buffer_text = ""
+                    LAST_LLM_CALL_TIME = current_time
+                else:
+                    # If not calling LLM, skip the rest of the loop and wait for next transcript
+                    time.sleep(0.1)
+                    continue  # Go to next iteration of while loop
 
-                # Reset the processing buffer and timer
-                llm_processing_buffer_text = ""
-                LAST_LLM_CALL_TIME = current_time
             else:
-                # If not calling LLM, skip the rest of the loop and wait for next transcript
                 time.sleep(0.1)
-                continue  # Go to next iteration of while loop
 
+        print(f"[{self.session_id}] Ollama processing thread stopped.")
+
+    def run_extraction(self, new_text, context_text):
+        """
+        Sends one batch of transcript text to Ollama for entity extraction,
+        merges the result into the cheat sheet and records the call's stats.
+        """
+        mode, use_schema = self.extraction_mode, self.extraction_use_schema
+        prompt = build_extraction_prompt(mode, self.current_video_title, new_text, context_text,
+                                         list(self.cheat_sheet_data.values()), use_schema)
+        messages = [
+            {"role": "user", "content": prompt}
+        ]
+
+        # Emit the prompt BEFORE the Ollama call
+        self.emit('llm_communication', {'prompt': prompt})
+
+        stats = self.extraction_stats
+        try:
+            # Make the call to the local Ollama server (queued behind other sessions)
+            response = ollama_scheduler.chat(model=OLLAMA_MODEL, messages=messages, format=output_format(mode, use_schema))
+            content = response['message']['content']
+        except Exception as e:
+            stats["calls"] += 1
+            stats["call_errors"] += 1
+            print(f"ERROR: [{self.session_id}] Error calling Ollama API: {e}")
+            traceback.print_exc()
+            return
+
+        # Ollama reports generated (decode) tokens as eval_count, and their time in nanoseconds as eval_duration
+        decode_tokens = response.get('eval_count') or 0
+        decode_seconds = (response.get('eval_duration') or 0) / 1e9
+        print(f"DEBUG: [{self.session_id}] Extraction call decoded {decode_tokens} tokens in {decode_seconds:.1f}s ({mode} mode, schema={use_schema}).")
+        self.record_extraction_response(mode, use_schema, content, decode_tokens, decode_seconds)
+
+        # Emit the raw response AFTER the Ollama call (before parsing)
+        self.emit('llm_communication', {'response': content})
+
+        extracted_entities, outcome = parse_extraction_output(content)
+        record_extraction_call(stats, outcome, decode_tokens, decode_seconds)
+
+        print(f"DEBUG: [{self.session_id}] Ollama extracted {len(extracted_entities)} entities from transcript ({outcome}).")
+        for entity in extracted_entities:
+            self.merge_entity(entity, description_is_delta=(mode == "terse"))
+
+    def record_extraction_response(self, mode, use_schema, content, decode_tokens, decode_seconds):
+        """
+        Appends a raw extraction response to EXTRACTION_RECORD_FILE, if set, for offline replay.
+        """
+        if not EXTRACTION_RECORD_FILE:
+            return
+        record = {
+            "session_id": self.session_id,
+            "mode": mode,
+            "schema": use_schema,
+            "content": content,
+            "eval_count": decode_tokens,
+            "eval_seconds": decode_seconds,
+        }
+        try:
+            with open(EXTRACTION_RECORD_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            print(f"ERROR: [{self.session_id}] Failed to record extraction response: {e}")
+
+    def merge_entity(self, entity, description_is_delta=False):
+        """
+        Adds a new entity to the cheat sheet or updates a known one, emitting the change.
+        With description_is_delta, the description holds only new facts and is appended.
+        """
+        existing_entity = self.cheat_sheet_data.get(entity['name'])
+        if not existing_entity:
+            # Add new entity
+            entity['description'] = cap_description(entity['description'])
+            self.cheat_sheet_data[entity['name']] = entity
+            print(f"DEBUG: [{self.session_id}] New entity found: {entity['name']} ({entity['type']})")
+            self.emit('update_cheat_sheet', entity)
+            return
+
+        changed = False
+        if description_is_delta:
+            new_description = merge_description(existing_entity.get('description') or "", entity['description'])
         else:
-            time.sleep(0.1)
+            new_description = cap_description(entity['description'])
+        # Update description only if it changed
+        if new_description and new_description != existing_entity.get('description'):
+            existing_entity['description'] = new_description
+            changed = True
+        # A date can arrive on its own, e.g. a terse Event update with only "dt"
+        if entity.get('date') and entity['date'] != existing_entity.get('date'):
+            existing_entity['date'] = entity['date']
+            changed = True
+
+        if changed:
+            print(f"DEBUG: [{self.session_id}] Updated entity: {entity['name']} ({entity['type']})")
+            self.emit('update_cheat_sheet', existing_entity)
+
+    # --- Lifecycle ---
+    def start(self):
+        """
+        Starts the audio capture, transcription, and LLM processing threads for this session.
+        Returns False if the session is already running. Callers hold session_lifecycle_lock.
+        """
+        if self.is_listening:
+            return False
+        self.is_listening = True
+
+        # Load data ONLY IF it's not a fresh start
+        if not self.load_session_data(): # Attempt to load previous session
+            self.cheat_sheet_data.clear() # If no session found, start fresh
+            self.llm_context_buffer.clear()
+            print(f"DEBUG: [{self.session_id}] Starting fresh session (no previous data found).")
+        else:
+            # If loaded, send existing data to frontend for display
+            self.emit('initial_cheat_sheet', list(self.cheat_sheet_data.values()))
+            self.emit('initial_transcript', {"history": self.llm_context_buffer}) # Send transcript history
+
+        # If no manual title was set, try to get it from the browser
+        if self.auto_detects_title() and self.current_video_title == "Unknown Video":
+            self.current_video_title = get_active_browser_tab_title()
+
+        print(f"DEBUG: [{self.session_id}] Session started. Initial/Selected video title: '{self.current_video_title}'")
+        self.emit('status', {'message': f'Starting analysis for: "{self.current_video_title}"'})
+
+        # Start background threads
+        print(f"DEBUG: [{self.session_id}] Launching audio_recorder thread...")
+        threading.Thread(target=self.audio_recorder, daemon=True).start()
+        print(f"DEBUG: [{self.session_id}] Launching transcribe_audio thread...")
+        threading.Thread(target=self.transcribe_audio, daemon=True).start()
+        print(f"DEBUG: [{self.session_id}] Launching process_transcript_with_ollama thread...")
+        threading.Thread(target=self.process_transcript_with_ollama, daemon=True).start()
+        print(f"DEBUG: [{self.session_id}] All threads launched.")
+        return True
+
+    def stop(self):
+        """
+        Signals this session's threads to stop and saves its data.
+        Returns False if the session was not running.
+        """
+        if not self.is_listening:
+            return False
+        self.is_listening = False # This flag signals threads to stop gracefully
+
+        self.save_session_data() # Save before clearing and stopping
+
+        # Clear queues immediately for a clean stop
+        while not self.audio_queue.empty(): self.audio_queue.get()
+        while not self.transcript_queue.empty(): self.transcript_queue.get()
+
+        # Frontend should NOT clear until it receives a specific command or on fresh start.
+        # Data persists in backend until a new session or app restart.
+
+        self.emit('status', {'message': 'Stopping...'})
+        print(f"DEBUG: [{self.session_id}] Backend stopping processing threads.")
+        return True
+
+    def ask(self, user_question):
+        """
+        Answers a user question using this session's Q&A history. Raises on Ollama errors.
+        """
+        # Prepare messages for this specific Q&A interaction
+        qa_messages = list(self.llm_messages_history) # Copy for this call
+        qa_messages.append({"role": "user", "content": user_question}) # Add user's question
+
+        response = ollama_scheduler.chat(model=OLLAMA_MODEL, messages=qa_messages)
+        ai_answer = response['message']['content'].strip()
+
+        # Update session history for future interactions
+        self.llm_messages_history.append({"role": "user", "content": user_question})
+        self.llm_messages_history.append({"role": "assistant", "content": ai_answer})
 
-    print("Ollama processing thread stopped.")
+        # Prune history, always keeping the system message
+        if len(self.llm_messages_history) > MAX_LLM_HISTORY_MESSAGES + 1:
+            self.llm_messages_history = [self.llm_messages_history[0]] + self.llm_messages_history[-(MAX_LLM_HISTORY_MESSAGES):]
+
+        # Emit the response to the LLM monitor
+        self.emit('llm_communication', {'response': ai_answer})
+        return ai_answer
+
+    # --- Persistence ---
+    def save_session_data(self):
+        """
+        Saves the session data (cheat sheet and transcript history) to the session's JSON file.
+        """
+        try:
+            data_to_save = {
+                "cheat_sheet": list(self.cheat_sheet_data.values()),
+                "transcript_history": list(self.llm_context_buffer) # Save current context buffer
+            }
+            with open(self.data_file, 'w', encoding='utf-8') as f:
+                json.dump(data_to_save, f, indent=4)
+            print(f"DEBUG: [{self.session_id}] Session data saved.")
+        except Exception as e:
+            print(f"ERROR: [{self.session_id}] Failed to save session data: {e}")
+            traceback.print_exc()
+
+    def load_session_data(self):
+        """
+        Loads session data from the session's JSON file if it exists.
+        Returns True if data was loaded successfully, False otherwise.
+        """
+        try:
+            if os.path.exists(self.data_file):
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    loaded_data = json.load(f)
+
+                # Clear current data before loading
+                self.cheat_sheet_data.clear()
+                self.llm_context_buffer.clear()
+
+                for entity in loaded_data.get("cheat_sheet", []):
+                    if 'name' in entity: # Ensure entity has a name
+                        self.cheat_sheet_data[entity['name']] = entity
+                self.llm_context_buffer.extend(loaded_data.get("transcript_history", []))
+
+                print(f"DEBUG: [{self.session_id}] Session data loaded. {len(self.cheat_sheet_data)} entities, {len(self.llm_context_buffer)} transcript chunks.")
+                return True
+            return False
+        except Exception as e:
+            print(f"ERROR: [{self.session_id}] Failed to load session data: {e}")
+            traceback.print_exc()
+            return False
+
+
+# --- Session Registry ---
+# All sessions in this process, keyed by session ID. They share whisper_pool and ollama_scheduler.
+sessions = {}
+sessions_lock = threading.Lock()
+# Serializes starting, stopping and removing sessions, so the "already running" check and the
+# single auto-detect device rule can't be raced by concurrent requests. Taken before sessions_lock.
+session_lifecycle_lock = threading.Lock()
+
+def get_session(session_id, create=True):
+    """
+    Returns the session with this ID, creating it if needed (or None if create=False).
+    The default session always exists, so the single-stream UI can use it before /start.
+    """
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None and (create or session_id == DEFAULT_SESSION_ID):
+            session = StreamSession(session_id)
+            sessions[session_id] = session
+            print(f"DEBUG: Created session '{session_id}'.")
+        return session
+
+def remove_session(session_id):
+    """
+    Drops a stopped session from the registry. Its data file stays on disk,
+    so starting the same session ID again resumes it.
+    Returns "removed", "default", "unknown" or "running".
+    """
+    if session_id == DEFAULT_SESSION_ID:
+        return "default"
+    with session_lifecycle_lock, sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            return "unknown"
+        if session.is_listening:
+            return "running"
+        del sessions[session_id]
+    print(f"DEBUG: Removed session '{session_id}'.")
+    return "removed"
+
+def auto_detect_session_running(exclude_session_id):
+    """
+    True if another running session captures from the auto-detected device.
+    Two such sessions would both record the same loopback audio.
+    """
+    with sessions_lock:
+        return any(
+            session.is_listening and session.input_device_index is None
+            for session_id, session in sessions.items() if session_id != exclude_session_id
+        )
+
+def is_valid_input_device(device_index):
+    """
+    Checks that device_index is an existing PyAudio input device (host API 0, as used by audio_recorder).
+    """
+    if not isinstance(device_index, int) or isinstance(device_index, bool) or device_index < 0:
+        return False
+    p = pyaudio.PyAudio()
+    try:
+        if device_index >= p.get_host_api_info_by_index(0).get('deviceCount'):
+            return False
+        device_info = p.get_device_info_by_host_api_device_index(0, device_index)
+        return device_info.get('maxInputChannels', 0) > 0
+    except Exception as e:
+        print(f"ERROR: Failed to query audio device {device_index}: {e}")
+        return False
+    finally:
+        p.terminate()
+
+def request_json():
+    """
+    Returns the JSON body of the current request as a dict ({} if there is none),
+    or None if the body is JSON but not an object.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    return data if isinstance(data, dict) else None
+
+def request_session_id():
+    """
+    Reads the target session ID from the JSON body or query string of the current request.
+    Falls back to DEFAULT_SESSION_ID. Returns None if the provided ID is invalid.
+    """
+    data = request_json() or {}
+    session_id = data.get('session_id') or request.args.get('session_id') or DEFAULT_SESSION_ID
+    return session_id if is_valid_session_id(session_id) else None
 
 
 # --- Flask API Endpoints ---
+# Every endpoint targets one session, given as "session_id" in the JSON body or query string.
+# Requests without one go to DEFAULT_SESSION_ID. Only /start creates new sessions.
+INVALID_SESSION_ERROR = {"error": "Invalid session_id (use 1-64 letters, digits, '-' or '_')"}
+UNKNOWN_SESSION_ERROR = {"error": "Unknown session_id (start the session first)"}
+INVALID_BODY_ERROR = {"error": "Request body must be a JSON object"}
+
 @app.route('/set_title', methods=['POST'])
 def set_title():
-    global current_video_title
-    data = request.get_json()
+    data = request_json()
+    if data is None:
+        return jsonify(INVALID_BODY_ERROR), 400
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    session = get_session(session_id, create=False)
+    if session is None:
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
     new_title = data.get('title')
     if new_title:
-        current_video_title = new_title
-        print(f"DEBUG: User-provided video title set: '{current_video_title}'")
+        session.set_title(new_title)
+        print(f"DEBUG: [{session_id}] User-provided video title set: '{session.current_video_title}'")
         # If already running, update status in UI immediately
-        if is_listening:
-            socketio.emit('status', {'message': f'Analyzing: "{current_video_title}"'})
-        return jsonify({"status": "title set", "title": current_video_title}), 200
+        if session.is_listening:
+            session.emit('status', {'message': f'Analyzing: "{session.current_video_title}"'})
+        return jsonify({"status": "title set", "title": session.current_video_title, "session_id": session_id}), 200
     return jsonify({"error": "No title provided"}), 400
 
 @app.route('/start', methods=['POST'])
 def start_processing():
     """
-    API endpoint to start the audio capture, transcription, and LLM processing threads.
+    API endpoint to start the audio capture, transcription, and LLM processing threads of a session,
+    creating the session if it doesn't exist yet.
+    Accepts an optional "extraction_mode" ("terse"/"verbose") and "use_schema" (bool), so both
+    extraction protocols can run side by side on the shared models and be compared via /extraction_stats.
+    Accepts an optional "device_index" (PyAudio input device) to capture from. Without one the
+    session auto-detects the system loopback device, which every session would capture identically,
+    so only one running session may auto-detect; concurrent streams need their own device_index.
     """
     print("DEBUG: /start endpoint received.")
-    global is_listening, cheat_sheet_data, llm_context_buffer, current_video_title
-    if not is_listening:
-        is_listening = True
-        
-        # Load data ONLY IF it's not a fresh start
-        if not load_session_data(): # Attempt to load previous session
-            cheat_sheet_data.clear() # If no session found, start fresh
-            llm_context_buffer.clear()
-            print("DEBUG: Starting fresh session (no previous data found).")
-        else:
-            # If loaded, send existing data to frontend for display
-            socketio.emit('initial_cheat_sheet', list(cheat_sheet_data.values()))
-            socketio.emit('initial_transcript', {"history": llm_context_buffer}) # Send transcript history
-
-        # If no manual title was set, try to get it from the browser
-        if current_video_title == "Unknown Video":
-            current_video_title = get_active_browser_tab_title()
-        
-        print(f"DEBUG: App started. Initial/Selected video title: '{current_video_title}'")
-        socketio.emit('status', {'message': f'Starting analysis for: "{current_video_title}"'})
-
-        # Start background threads
-        print("DEBUG: Launching audio_recorder thread...")
-        threading.Thread(target=audio_recorder, daemon=True).start()
-        print("DEBUG: Launching transcribe_audio thread...")
-        threading.Thread(target=transcribe_audio, daemon=True).start()
-        print("DEBUG: Launching process_transcript_with_ollama thread...")
-        threading.Thread(target=process_transcript_with_ollama, daemon=True).start()
-        print("DEBUG: All threads launched.")
-        return jsonify({"status": "started"}), 200
-    print("DEBUG: Already listening, /start ignored.")
-    return jsonify({"status": "already running"}), 200
+    data = request_json()
+    if data is None:
+        return jsonify(INVALID_BODY_ERROR), 400
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    device_index = data.get('device_index')
+    if device_index is not None and not is_valid_input_device(device_index):
+        return jsonify({"error": f"Invalid device_index: {device_index!r} (expected an audio input device index >= 0)"}), 400
+    extraction_mode = data.get('extraction_mode')
+    if extraction_mode is not None and extraction_mode not in EXTRACTION_MODES:
+        return jsonify({"error": f"Invalid extraction_mode: {extraction_mode!r} (expected one of {list(EXTRACTION_MODES)})"}), 400
+    use_schema = data.get('use_schema')
+    if use_schema is not None and not isinstance(use_schema, bool):
+        return jsonify({"error": "Invalid use_schema (expected true or false)"}), 400
+
+    with session_lifecycle_lock:
+        # Validate everything before creating or changing the session
+        session = get_session(session_id, create=False)
+        if session and session.is_listening:
+            print(f"DEBUG: [{session_id}] Already listening, /start ignored.")
+            return jsonify({"status": "already running", "session_id": session_id}), 200
+        if device_index is None and session:
+            device_index = session.input_device_index
+        if device_index is None and auto_detect_session_running(session_id):
+            return jsonify({"error": "Another session is already capturing the auto-detected audio device. Pass a device_index."}), 409
+
+        session = get_session(session_id)
+        session.input_device_index = device_index
+        if extraction_mode is not None or use_schema is not None:
+            session.set_extraction_protocol(
+                extraction_mode if extraction_mode is not None else session.extraction_mode,
+                use_schema if use_schema is not None else session.extraction_use_schema)
+        session.start()
+    return jsonify({"status": "started", "session_id": session_id}), 200
 
 @app.route('/stop', methods=['POST'])
 def stop_processing():
     """
-    API endpoint to stop all audio processing threads.
+    API endpoint to stop a session's audio processing threads.
     """
     print("DEBUG: /stop endpoint received.")
-    global is_listening
-    if is_listening:
-        is_listening = False # This flag signals threads to stop gracefully
-        
-        save_session_data() # Save before clearing and stopping
-        
-        # Clear queues immediately for a clean stop
-        while not audio_queue.empty(): audio_queue.get()
-        while not transcript_queue.empty(): transcript_queue.get()
-        
-        # Frontend should NOT clear until it receives a specific command or on fresh start.
-        # Data persists in backend until a new session or app restart.
-
-        socketio.emit('status', {'message': 'Stopping...'})
-        print("DEBUG: Backend stopping processing threads.")
-        return jsonify({"status": "stopping"}), 200
-    print("DEBUG: Not running, /stop ignored.")
-    return jsonify({"status": "not running"}), 200
+    if request_json() is None:
+        return jsonify(INVALID_BODY_ERROR), 400
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    session = get_session(session_id, create=False)
+    if session is None:
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
+    with session_lifecycle_lock:
+        stopped = session.stop()
+    if stopped:
+        return jsonify({"status": "stopping", "session_id": session_id}), 200
+    print(f"DEBUG: [{session_id}] Not running, /stop ignored.")
+    return jsonify({"status": "not running", "session_id": session_id}), 200
 
 @app.route('/status', methods=['GET'])
 def get_status():
     """
-    API endpoint to get the current status of the backend (listening or idle).
+    API endpoint to get the current status of a session (listening or idle).
+    """
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    session = get_session(session_id, create=False)
+    if session is None:
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
+    return jsonify({"is_listening": session.is_listening, "cheat_sheet_size": len(session.cheat_sheet_data), "session_id": session_id}), 200
+
+@app.route('/extraction_stats', methods=['GET'])
+def get_extraction_stats():
+    """
+    API endpoint to get a session's extraction metrics: decode tokens per call and
+    the fraction of batches lost to unusable LLM output.
+    """
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    session = get_session(session_id, create=False)
+    if session is None:
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
+    return jsonify(summarize_extraction_stats(session.extraction_stats)), 200
+
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
     """
-    return jsonify({"is_listening": is_listening, "cheat_sheet_size": len(cheat_sheet_data)}), 200
+    API endpoint to list all sessions known to this backend process.
+    """
+    with sessions_lock:
+        all_sessions = list(sessions.values())
+    return jsonify([session.summary() for session in all_sessions]), 200
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """
+    API endpoint to remove a stopped session from this backend process.
+    """
+    if not is_valid_session_id(session_id):
+        return jsonify(INVALID_SESSION_ERROR), 400
+    outcome = remove_session(session_id)
+    if outcome == "removed":
+        return jsonify({"status": "removed", "session_id": session_id}), 200
+    if outcome == "unknown":
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
+    if outcome == "running":
+        return jsonify({"error": "Session is still running; stop it first"}), 409
+    return jsonify({"error": "The default session cannot be removed"}), 400
 
 @app.route('/cheat_sheet', methods=['GET'])
 def get_cheat_sheet():
     """
-    API endpoint to get the current state of the cheat sheet.
+    API endpoint to get the current state of a session's cheat sheet.
     """
-    return jsonify(list(cheat_sheet_data.values())), 200
+    session_id = request_session_id()
+    if session_id is None:
+        return jsonify(INVALID_SESSION_ERROR), 400
+    session = get_session(session_id, create=False)
+    if session is None:
+        return jsonify(UNKNOWN_SESSION_ERROR), 404
+    return jsonify(list(session.cheat_sheet_data.values())), 200
 
 @app.route('/ask_llm', methods=['POST'])
 def ask_llm():
     """
     API endpoint for user to ask specific questions to the LLM.
-    Uses the current cheat sheet and recent transcript history as context.
+    Uses the session's conversation history as context.
     """
     try:
-        data = request.get_json()
+        data = request_json()
+        if data is None:
+            return jsonify(INVALID_BODY_ERROR), 400
+        session_id = request_session_id()
+        if session_id is None:
+            return jsonify(INVALID_SESSION_ERROR), 400
         user_question = data.get('question')
         if not user_question:
             return jsonify({"error": "No question provided"}), 400
 
-        print(f"DEBUG: Received LLM question: '{user_question}'")
-        global llm_messages_history # Add to global here
-
-        # Prepare context for the LLM
-        current_cheat_sheet_json = json.dumps(list(cheat_sheet_data.values()), indent=2)
-        current_context_text = " ".join(llm_context_buffer) # Use the rolling buffer
-
-        # Prepare messages for this specific Q&A interaction
-        qa_messages = list(llm_messages_history) # Copy for this call
-        qa_messages.append({"role": "user", "content": user_question}) # Add user's question
+        session = get_session(session_id, create=False)
+        if session is None:
+            return jsonify(UNKNOWN_SESSION_ERROR), 404
+        print(f"DEBUG: [{session_id}] Received LLM question: '{user_question}'")
 
         try:
-            response = ollama.chat(model=OLLAMA_MODEL, messages=qa_messages)
-            ai_answer = response['message']['content'].strip()
-
-            # Update global history for future interactions
-            llm_messages_history.append({"role": "user", "content": user_question})
-            llm_messages_history.append({"role": "assistant", "content": ai_answer})
-            
-            # Prune history (same logic as entity extraction)
-            MAX_LLM_HISTORY_MESSAGES = 10 # Adjust as needed
-            if len(llm_messages_history) > MAX_LLM_HISTORY_MESSAGES + 1:
-                llm_messages_history = [llm_messages_history[0]] + llm_messages_history[-(MAX_LLM_HISTORY_MESSAGES):]
-
-            # Emit the response to the LLM monitor
-            socketio.emit('llm_communication', {'response': ai_answer})
-
-            print(f"DEBUG: LLM answered question: '{ai_answer}'")
+            ai_answer = session.ask(user_question)
+            print(f"DEBUG: [{session_id}] LLM answered question: '{ai_answer}'")
             return jsonify({"answer": ai_answer}), 200
 
         except Exception as e:
@@ -630,64 +1042,48 @@ def ask_llm():
         return jsonify({"error": str(e)}), 500
 
 # --- SocketIO Events ---
-# These are mainly for initial connection and can be expanded for more direct communication
+# Clients receive events only for the sessions whose rooms they are in.
+# On connect a client joins the session given in its "session_id" query parameter (default session otherwise).
 @socketio.on('connect')
 def handle_connect():
-    print("DEBUG: Client connected via Socket.IO!")
+    session_id = request.args.get('session_id', DEFAULT_SESSION_ID)
+    if not is_valid_session_id(session_id):
+        session_id = DEFAULT_SESSION_ID
+    join_room(session_room(session_id))
+    print(f"DEBUG: Client connected via Socket.IO! Following session '{session_id}'.")
     # Emit status directly on connect, useful for initial UI state
     emit('status', {'message': 'Connected to backend.'})
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    print("DEBUG: Client disconnected from Socket.IO.")
-
-def save_session_data():
+@socketio.on('join_session')
+def handle_join_session(data):
     """
-    Saves the current session data (cheat sheet and transcript history) to a JSON file.
+    Subscribes the client to another session's events and sends it that session's current state.
     """
-    try:
-        data_to_save = {
-            "cheat_sheet": list(cheat_sheet_data.values()),
-            "transcript_history": list(llm_context_buffer) # Save current context buffer
-        }
-        with open(SESSION_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, indent=4)
-        print("DEBUG: Session data saved.")
-    except Exception as e:
-        print(f"ERROR: Failed to save session data: {e}")
-        traceback.print_exc()
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if not is_valid_session_id(session_id):
+        emit('status', {'message': f'Invalid session: {session_id}'})
+        return
+    join_room(session_room(session_id))
+    print(f"DEBUG: Client joined session '{session_id}'.")
+    session = get_session(session_id, create=False)
+    if session:
+        emit('initial_cheat_sheet', list(session.cheat_sheet_data.values()))
+        emit('initial_transcript', {"history": session.llm_context_buffer})
+
+@socketio.on('leave_session')
+def handle_leave_session(data):
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if is_valid_session_id(session_id):
+        leave_room(session_room(session_id))
+        print(f"DEBUG: Client left session '{session_id}'.")
 
-def load_session_data():
-    """
-    Loads session data from the JSON file if it exists.
-    Returns True if data was loaded successfully, False otherwise.
-    """
-    global cheat_sheet_data, llm_context_buffer
-    try:
-        if os.path.exists(SESSION_DATA_FILE):
-            with open(SESSION_DATA_FILE, 'r', encoding='utf-8') as f:
-                loaded_data = json.load(f)
-            
-            # Clear current data before loading
-            cheat_sheet_data.clear()
-            llm_context_buffer.clear()
-
-            for entity in loaded_data.get("cheat_sheet", []):
-                if 'name' in entity: # Ensure entity has a name
-                    cheat_sheet_data[entity['name']] = entity
-            llm_context_buffer.extend(loaded_data.get("transcript_history", []))
-
-            print(f"DEBUG: Session data loaded. {len(cheat_sheet_data)} entities, {len(llm_context_buffer)} transcript chunks.")
-            return True
-        return False
-    except Exception as e:
-        print(f"ERROR: Failed to load session data: {e}")
-        traceback.print_exc()
-        return False
+@socketio.on('disconnect')
+def handle_disconnect():
+    print("DEBUG: Client disconnected from Socket.IO.")
 
 # --- Main execution block ---
 if __name__ == '__main__':
     # When run directly, start the Flask/SocketIO server
     # debug=False for production use (or when running via Electron)
     print("DEBUG: Starting Flask/SocketIO server...")
-    socketio.run(app, host='127.0.0.1', port=5000, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    socketio.run(app, host='127.0.0.1', port=5000, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,369 @@
+"""
+Entity extraction protocol shared by the backend and the offline replay harness.
+
+The output is constrained with a JSON schema passed through Ollama's structured-output
+`format`, so the model cannot drift into other keys or prose. In "terse" mode the model
+emits one-letter type codes and short keys, and for entities already on the cheat sheet
+only the new facts, which cuts decode tokens (the dominant cost on CPU).
+
+This module only depends on the standard library, so extraction_replay.py can use it
+without loading audio, Whisper or Flask.
+"""
+import json
+import re
+
+EXTRACTION_MODES = ("terse", "verbose")
+
+ENTITY_TYPE_CODES = {
+    "C": "Character",
+    "L": "Location",
+    "O": "Organization",
+    "I": "Key Object",
+    "K": "Concept",
+    "E": "Event",
+}
+
+MAX_ENTITY_DESCRIPTION_CHARS = 300  # Cap on a merged cheat sheet description
+TERSE_DESCRIPTION_WORDS = 15        # Word limit the terse prompt asks for in "d"
+MIN_NOVEL_WORD_FRACTION = 0.3       # A terse delta whose content words are mostly already recorded is a restatement
+
+def _entities_schema(item_properties, required):
+    return {
+        "type": "object",
+        "properties": {
+            "entities": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": item_properties,
+                    "required": required,
+                },
+            },
+        },
+        "required": ["entities"],
+    }
+
+VERBOSE_ENTITY_SCHEMA = _entities_schema(
+    {
+        "type": {"type": "string", "enum": list(ENTITY_TYPE_CODES.values())},
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "date": {"type": "string"},
+    },
+    ["type", "name", "description"],
+)
+
+TERSE_ENTITY_SCHEMA = _entities_schema(
+    {
+        "t": {"type": "string", "enum": list(ENTITY_TYPE_CODES.keys())},
+        "n": {"type": "string"},
+        "d": {"type": "string"},
+        "dt": {"type": "string"},
+    },
+    ["t", "n", "d"],
+)
+
+def output_format(mode, use_schema):
+    """
+    The `format` argument for ollama.chat(): the mode's JSON schema, or plain 'json'.
+    """
+    if not use_schema:
+        return 'json'
+    return TERSE_ENTITY_SCHEMA if mode == "terse" else VERBOSE_ENTITY_SCHEMA
+
+def build_verbose_extraction_prompt(video_title, new_text, context_text, cheat_sheet_entities, use_schema=True):
+    """
+    The original full-JSON extraction prompt. The model returns complete descriptions
+    and sees the whole cheat sheet as context.
+    """
+    current_cheat_sheet_json = json.dumps(cheat_sheet_entities, indent=2)
+    if use_schema:
+        output_shape = """Crucially, format your output as a JSON object with a single key 'entities' holding an array of objects.
+Each object MUST have the keys 'type', 'name', and 'description'.
+For 'Event' type entities, you MAY include an optional 'date' key if a specific date or timeframe is mentioned.
+If no new or updated entities are found that fit the criteria, return {"entities": []}."""
+    else:
+        output_shape = """Crucially, format your output as a JSON array of objects.
+Each object MUST have the keys 'type', 'name', and 'description'.
+For 'Event' type entities, you MAY include an optional 'date' key if a specific date or timeframe is mentioned.
+Do NOT include any other keys or outer objects like 'entities'. Just the array.
+If no new or updated entities are found that fit the criteria, return an empty array []."""
+
+    return f"""
+You are an AI assistant specialized in extracting named entities from video transcripts to create a structured cheat sheet.
+Your primary goal is to help a user follow the narrative or informational content of a video.
+The current video title is: "{video_title}".
+
+Text to analyze for new entities:
+{new_text}
+
+Broader historical context:
+{context_text}
+
+Based on this title and the content, identify entities that are relevant to the narrative/story/topic of this specific video. Focus on:
+
+    Characters: Individuals, sentient beings, their roles, and key relationships.
+
+    Locations: Specific places (cities, buildings, fictional realms), their significance.
+
+    Organizations: Groups, factions, institutions relevant to the plot/topic.
+
+    Key Objects/Items: Important artifacts, tools, or unique items that drive the story/topic.
+
+    Concepts/Events: Important ideas, theories, historical events, or major plot points.
+    For 'Event' entities, include an optional 'date' key with a relevant date/timeframe if explicitly mentioned.
+
+For each identified entity, provide its 'type' (e.g., "Character", "Location", "Concept"), 'name', and a concise 'description'.
+If an entity has been previously mentioned in the context and new information is provided, update its 'description'.
+Only include entities that are clearly named or explicitly described in the transcript and are relevant to the main content of the video as suggested by its title and ongoing discussion.
+
+{output_shape}
+
+Example JSON for a Character: {{"type": "Character", "name": "John Doe", "description": "A brave knight who served King Arthur."}}
+Example JSON for a Location: {{"type": "Location", "name": "Camelot", "description": "King Arthur's legendary castle."}}
+Example JSON for an Event: {{"type": "Event", "name": "Battle of Gettysburg", "description": "Major battle of the American Civil War.", "date": "July 1-3, 1863"}}
+
+Current cheat sheet context (as JSON array):
+{current_cheat_sheet_json}
+
+JSON Output:
+"""
+
+def build_terse_extraction_prompt(video_title, new_text, context_text, cheat_sheet_entities, use_schema=True):
+    """
+    Compact extraction prompt. Known entities are listed with their full stored description
+    (at most MAX_ENTITY_DESCRIPTION_CHARS each), so the model can tell which facts are new and
+    only decode those. The known-entity list costs prefill tokens only.
+    Without a schema the output rules are spelled out, since nothing else enforces them.
+    """
+    type_legend = ", ".join(f"{code}={name}" for code, name in ENTITY_TYPE_CODES.items())
+    known_entities = "\n".join(
+        f"- {entity['name']}: {entity.get('description') or ''}"
+        for entity in cheat_sheet_entities if entity.get('name')
+    ) or "(none yet)"
+    if use_schema:
+        output_rules = ""
+    else:
+        output_rules = f"""Respond with ONLY that JSON object: no text before or after it, no other top-level keys.
+"t" MUST be one of: {", ".join(ENTITY_TYPE_CODES)}. Every entity MUST have "t", "n" and "d".
+"""
+
+    return f"""
+Extract named entities from a video transcript for a viewer's cheat sheet.
+Video title: "{video_title}".
+
+New transcript text:
+{new_text}
+
+Earlier context:
+{context_text}
+
+Known entities (name: what is already recorded):
+{known_entities}
+
+Output {{"entities": [...]}}. Each entity: "t" = type code ({type_legend}), "n" = name, "d" = description of at most {TERSE_DESCRIPTION_WORDS} words.
+{output_rules}For Events you MAY add "dt" = date/timeframe if one is stated.
+For a known entity, include it only if the new text adds facts that are NOT already recorded above, and put ONLY those new facts in "d".
+If the only new fact about a known Event is its date, give "dt" and leave "d" empty.
+Only include clearly named entities relevant to the video. If nothing is new, output {{"entities": []}}.
+Example: {{"entities": [{{"t": "C", "n": "John Doe", "d": "Knight serving King Arthur."}}]}}
+"""
+
+def build_extraction_prompt(mode, video_title, new_text, context_text, cheat_sheet_entities, use_schema=True):
+    build_prompt = build_terse_extraction_prompt if mode == "terse" else build_verbose_extraction_prompt
+    return build_prompt(video_title, new_text, context_text, cheat_sheet_entities, use_schema)
+
+def salvage_entity_objects(content):
+    """
+    Recovers every complete JSON object from malformed output, e.g. an array that was
+    cut off mid-entity or followed by stray text. Incomplete trailing objects are dropped.
+    """
+    decoder = json.JSONDecoder()
+    entities = []
+    pos = content.find('{')
+    while pos != -1:
+        try:
+            obj, end = decoder.raw_decode(content, pos)
+        except json.JSONDecodeError:
+            pos = content.find('{', pos + 1)
+            continue
+        if isinstance(obj, dict) and isinstance(obj.get("entities"), list):
+            entities.extend(item for item in obj["entities"] if isinstance(item, dict))
+        elif isinstance(obj, dict):
+            entities.append(obj)
+        pos = content.find('{', end)
+    return entities
+
+def _normalize_all(raw_entities):
+    entities = []
+    for raw_entity in raw_entities:
+        entity = normalize_entity(raw_entity)
+        if entity:
+            entities.append(entity)
+        else:
+            print(f"WARNING: Malformed entity from Ollama (missing 'name'/'type'): {raw_entity}")
+    return entities
+
+def parse_extraction_output(content):
+    """
+    Parses the LLM's extraction output into a list of normalized cheat sheet entities.
+    Accepts an {"entities": [...]} object, a bare array or a single bare entity, and
+    falls back to salvage_entity_objects() for malformed JSON.
+    Returns (entities, outcome) where outcome is:
+      "ok"       - valid JSON with at least one usable entity, or an explicit empty list
+      "salvaged" - malformed JSON, but usable entities were recovered
+      "lost"     - nothing usable, e.g. undecodable output or {"Character": [...]}
+    """
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError as e:
+        print(f"WARNING: Failed to decode Ollama JSON ({e}). Attempting to salvage entities.")
+        entities = _normalize_all(salvage_entity_objects(content))
+        if not entities:
+            print(f"ERROR: Nothing salvageable in Ollama output: {content}")
+            return [], "lost"
+        print(f"DEBUG: Salvaged {len(entities)} entities from malformed Ollama output.")
+        return entities, "salvaged"
+
+    # --- Robustness: Unwrap if Ollama put the array in an 'entities' object ---
+    if isinstance(parsed, dict) and "entities" in parsed:
+        parsed = parsed["entities"]
+    elif isinstance(parsed, dict) and normalize_entity(parsed):
+        parsed = [parsed] # A single bare entity object
+
+    if not isinstance(parsed, list):
+        print(f"WARNING: Ollama did not return a JSON array as expected (after unwrap attempt): {content}")
+        return [], "lost"
+    if not parsed:
+        return [], "ok" # The model found nothing new
+
+    entities = _normalize_all(item for item in parsed if isinstance(item, dict))
+    if not entities:
+        print(f"WARNING: Ollama output contained no usable entities: {content}")
+        return [], "lost"
+    return entities, "ok"
+
+def normalize_entity(raw_entity):
+    """
+    Maps a raw entity in either the verbose or terse format to the cheat sheet format
+    {'name', 'type', 'description'[, 'date']}. Returns None if the name or type is missing,
+    or if a terse "t" is not one of ENTITY_TYPE_CODES. Verbose types stay free-form as before.
+    """
+    # --- Robustness: Handle different key names from Ollama if it deviates ---
+    name = raw_entity.get('name') or raw_entity.get('n') or raw_entity.get('entity') or raw_entity.get('value')
+    entity_type = raw_entity.get('type')
+    if not entity_type and isinstance(raw_entity.get('t'), str):
+        # Terse entities must use a known type code (or spell out a known type)
+        code = raw_entity['t'].strip()
+        entity_type = ENTITY_TYPE_CODES.get(code.upper()) or (code if code in ENTITY_TYPE_CODES.values() else None)
+    description = raw_entity.get('description') or raw_entity.get('d') or ""
+    date = raw_entity.get('date') or raw_entity.get('dt')
+
+    if not isinstance(name, str) or not isinstance(entity_type, str) or not name.strip() or not entity_type.strip():
+        return None
+    entity_type = ENTITY_TYPE_CODES.get(entity_type.strip().upper(), entity_type.strip())
+
+    entity = {
+        'name': name.strip(),
+        'type': entity_type,
+        'description': description.strip() if isinstance(description, str) else str(description)
+    }
+    if isinstance(date, str) and date.strip():
+        entity['date'] = date.strip()
+    return entity
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r"[a-z0-9']+")
+
+def _content_words(text):
+    return {word for word in WORD.findall(text.lower()) if len(word) > 3}
+
+def _as_sentence(text):
+    text = " ".join(text.split())
+    return text if not text or text[-1] in ".!?" else text + "."
+
+def is_restatement(existing, delta):
+    """
+    True if a delta adds (almost) nothing to the stored description: fewer than
+    MIN_NOVEL_WORD_FRACTION of its content words are new. Catches reworded repeats
+    that an exact substring check would miss.
+    """
+    delta_words = _content_words(delta)
+    if not delta_words:
+        return " ".join(delta.lower().split()) in " ".join(existing.lower().split())
+    novel = delta_words - _content_words(existing)
+    return len(novel) / len(delta_words) < MIN_NOVEL_WORD_FRACTION
+
+def cap_description(description):
+    """
+    Trims a description to MAX_ENTITY_DESCRIPTION_CHARS at a word boundary.
+    """
+    if len(description) <= MAX_ENTITY_DESCRIPTION_CHARS:
+        return description
+    return description[:MAX_ENTITY_DESCRIPTION_CHARS - 4].rsplit(' ', 1)[0] + " ..."
+
+def merge_description(existing, delta):
+    """
+    Appends the new facts from a terse-mode delta to a stored description, one sentence per fact.
+    Restatements (see is_restatement()) are skipped.
+    Eviction policy when the result would exceed MAX_ENTITY_DESCRIPTION_CHARS: the first
+    sentence (the defining description the entity was added with) is always kept, and the
+    oldest appended sentences are dropped first, so the newest facts survive.
+    """
+    if not existing:
+        return cap_description(_as_sentence(delta))
+    if not delta or is_restatement(existing, delta):
+        return existing
+
+    head, *facts = SENTENCE_BOUNDARY.split(_as_sentence(existing))
+    facts.append(_as_sentence(delta))
+    while facts and len(" ".join([head] + facts)) > MAX_ENTITY_DESCRIPTION_CHARS:
+        facts.pop(0)
+    if not facts:
+        # Even the newest fact doesn't fit next to the head: keep the head and a trimmed fact
+        head = cap_description(head)
+        room = MAX_ENTITY_DESCRIPTION_CHARS - len(head) - 1
+        return f"{head} {cap_description(_as_sentence(delta))[:room]}".strip() if room > 10 else head
+    return " ".join([head] + facts)
+
+def new_extraction_stats(mode, use_schema):
+    """
+    Per-session counters for comparing extraction modes: decode tokens per call
+    and the fraction of batches whose output could not be used.
+    """
+    return {
+        "mode": mode,
+        "schema": use_schema,
+        "calls": 0,
+        "call_errors": 0,
+        "batches_salvaged": 0,
+        "batches_lost": 0,
+        "decode_tokens": 0,
+        "decode_seconds": 0.0,
+    }
+
+def summarize_extraction_stats(stats):
+    """
+    Adds derived rates to the counters. Loss rates are over answered calls (calls minus
+    call_errors). batch_loss_rate_without_salvage counts salvaged batches as lost too,
+    which is what the plain json.loads() parser would have done with them.
+    """
+    answered = stats["calls"] - stats["call_errors"]
+    summary = dict(stats)
+    summary["avg_decode_tokens_per_call"] = round(stats["decode_tokens"] / answered, 1) if answered else 0.0
+    summary["batch_loss_rate"] = round(stats["batches_lost"] / answered, 3) if answered else 0.0
+    summary["batch_loss_rate_without_salvage"] = round((stats["batches_lost"] + stats["batches_salvaged"]) / answered, 3) if answered else 0.0
+    summary["decode_tokens_per_second"] = round(stats["decode_tokens"] / stats["decode_seconds"], 1) if stats["decode_seconds"] else 0.0
+    return summary
+
+def record_extraction_call(stats, outcome, decode_tokens=0, decode_seconds=0.0):
+    """
+    Updates the counters for one answered extraction call.
+    """
+    stats["calls"] += 1
+    stats["decode_tokens"] += decode_tokens
+    stats["decode_seconds"] += decode_seconds
+    if outcome == "salvaged":
+        stats["batches_salvaged"] += 1
+    elif outcome == "lost":
+        stats["batches_lost"] += 1
@@ -0,0 +1,113 @@
+"""
+Offline replay of recorded extraction responses.
+
+Start the backend with EXTRACTION_RECORD_FILE=extraction_calls.jsonl in the environment, run
+sessions in the protocols you want to compare (e.g. one started with
+{"extraction_mode": "verbose", "use_schema": false} and one with the defaults), then run:
+
+    python extraction_replay.py extraction_calls.jsonl
+
+For every protocol in the recording this reports decode tokens per call and the fraction
+of batches lost, both with the original json.loads()-only parser ("legacy") and with
+parse_extraction_output(), which salvages partial arrays.
+
+extraction_samples.jsonl is a small hand-written response set covering the usual failure
+shapes (truncated arrays, trailing text, {"Character": [...]}, {"entities": null}) for the
+same eight batches in both protocols. It has no eval_count, so its token figures are
+estimates (marked "~") from the response length.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import sys
+
+from extraction import new_extraction_stats, normalize_entity, parse_extraction_output, record_extraction_call, summarize_extraction_stats
+
+
+def legacy_parse_outcome(content):
+    """
+    Outcome of the parser the backend used before the extraction protocol:
+    json.loads(), unwrap an 'entities' object, and keep entities with a name and type
+    (read with normalize_entity(), so terse keys count too). Any JSONDecodeError lost the whole batch.
+    """
+    try:
+        extracted = json.loads(content)
+    except json.JSONDecodeError:
+        return "lost"
+    if isinstance(extracted, dict) and "entities" in extracted:
+        extracted = extracted["entities"]
+    if not isinstance(extracted, list):
+        return "lost"
+    if not extracted:
+        return "ok"
+    usable = [entity for entity in extracted if isinstance(entity, dict) and normalize_entity(entity)]
+    return "ok" if usable else "lost"
+
+
+CHARS_PER_TOKEN = 4 # Rough average for English and JSON with a Llama-style tokenizer
+
+def estimate_decode_tokens(content):
+    return math.ceil(len(content) / CHARS_PER_TOKEN)
+
+
+def replay(records, verbose=False):
+    """
+    Returns {(mode, schema): {"current": summary, "legacy_batch_loss_rate": rate, "estimated": bool}}.
+    """
+    current = {}
+    legacy_lost = {}
+    estimated = set()
+    for record in records:
+        key = (record.get("mode", "verbose"), record.get("schema", False))
+        stats = current.setdefault(key, new_extraction_stats(*key))
+        content = record.get("content") or ""
+
+        quiet = io.StringIO()
+        with contextlib.redirect_stdout(sys.stdout if verbose else quiet):
+            _, outcome = parse_extraction_output(content)
+        decode_tokens = record.get("eval_count")
+        if decode_tokens is None:
+            decode_tokens = estimate_decode_tokens(content)
+            estimated.add(key)
+        record_extraction_call(stats, outcome, decode_tokens, record.get("eval_seconds") or 0.0)
+
+        if legacy_parse_outcome(content) == "lost":
+            legacy_lost[key] = legacy_lost.get(key, 0) + 1
+
+    results = {}
+    for key, stats in current.items():
+        calls = stats["calls"]
+        results[key] = {
+            "current": summarize_extraction_stats(stats),
+            "legacy_batch_loss_rate": round(legacy_lost.get(key, 0) / calls, 3) if calls else 0.0,
+            "estimated": key in estimated,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded extraction responses through the extraction parsers.")
+    parser.add_argument("record_file", help="JSONL file written via EXTRACTION_RECORD_FILE")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show parser warnings")
+    args = parser.parse_args()
+
+    with open(args.record_file, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    results = replay(records, verbose=args.verbose)
+    if not results:
+        print("No recorded extraction calls found.")
+        return
+
+    print(f"{'mode':<8} {'schema':<7} {'calls':>6} {'tokens/call':>12} {'lost (legacy)':>14} {'lost (now)':>11} {'salvaged':>9}")
+    for (mode, schema), result in sorted(results.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        summary = result["current"]
+        tokens = f"{'~' if result['estimated'] else ''}{summary['avg_decode_tokens_per_call']}"
+        print(f"{mode:<8} {str(schema):<7} {summary['calls']:>6} {tokens:>12} "
+              f"{result['legacy_batch_loss_rate']:>14.1%} {summary['batch_loss_rate']:>11.1%} {summary['batches_salvaged']:>9}")
+
+
+if __name__ == '__main__':
+    main()